@@ -52,14 +52,37 @@ The following environment variables MAY be set to customize lockbox's behaviour:
 """
 
 
+import atexit
 import logging
+import logging.handlers
+import queue
 from .server import LockboxServer
+# uvloop isn't available on every platform (e.g. Windows), in which case the default asyncio loop is used
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+def _queue_handler(handler: logging.Handler) -> logging.Handler:
+    """
+    Wrap a handler so that logging only puts records on a queue,
+    and the handler writes them out from a background thread.
+    """
+    q = queue.Queue()
+    listener = logging.handlers.QueueListener(q, handler, respect_handler_level=True)
+    listener.start()
+    # Flush what's left on exit
+    atexit.register(listener.stop)
+    queue_handler = logging.handlers.QueueHandler(q)
+    queue_handler.setLevel(handler.level)
+    return queue_handler
 
 def setup_loggers(level: int):
     handler = logging.StreamHandler()
     handler.setLevel(level)
     formatter = logging.Formatter("%(asctime)s - %(levelname)s: %(name)s: %(message)s")
     handler.setFormatter(formatter)
+    handler = _queue_handler(handler)
 
     for name in ["scheduler", "task", "server", "db", "ghoster"]:
         logger = logging.getLogger(name)
@@ -67,8 +90,11 @@ def setup_loggers(level: int):
         logger.addHandler(handler)
 
     # aiohttp access gets separate handler for different format since it already has enough info
+    # The access logger only logs the request itself, so the time is added here
     ah_handler = logging.StreamHandler()
     ah_handler.setLevel(level)
+    ah_handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
+    ah_handler = _queue_handler(ah_handler)
     ah_logger = logging.getLogger("aiohttp.access")
     ah_logger.setLevel(level)
     ah_logger.addHandler(ah_handler)
@@ -76,6 +102,9 @@ def setup_loggers(level: int):
 def main():
     print("-------- lockbox started --------")
     setup_loggers(logging.DEBUG)
+    # This has to happen before the server gets an event loop to run on
+    if uvloop is not None:
+        uvloop.install()
     print("Initializing lockbox server")
     server = LockboxServer()
     print("Starting lockbox server")
@@ -9,6 +9,7 @@ import datetime
 import gridfs
 import logging
 import os
+import pymongo
 import secrets
 import typing
 from cryptography.fernet import Fernet, InvalidToken
@@ -46,7 +47,8 @@ class LockboxDB:
     Holds databases for lockbox.
     """
 
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, min_pool_size: int = 0, max_pool_size: int = 100,
+            max_idle_time_ms: typing.Optional[int] = None):
         # Set up fernet
         # Read from base64 encoded key
         if os.environ.get("LOCKBOX_CREDENTIAL_KEY"):
@@ -72,7 +74,8 @@ class LockboxDB:
         else:
             self.school_code = None
 
-        self.client = AsyncIOMotorClient(host, port)
+        self.client = AsyncIOMotorClient(host, port, minPoolSize=min_pool_size, maxPoolSize=max_pool_size,
+            maxIdleTimeMS=max_idle_time_ms)
         self._private_db = self.client["lockbox"]
         self._shared_db = self.client["shared"]
         self._private_instance = MotorAsyncIOInstance(self._private_db)
@@ -104,6 +107,8 @@ class LockboxDB:
         """
         Initialize the databases and task scheduler.
         """
+        # Connect before anything else, which also starts filling the connection pool up to its minimum size
+        await self.client.admin.command("ping")
         await self.UserImpl.ensure_indexes()
         await self.CourseImpl.ensure_indexes()
         await self.CachedFormGeometryImpl.collection.drop()
@@ -162,24 +167,37 @@ class LockboxDB:
             user.courses = []
         else:
             user.courses = user.courses or []
-        # Populate courses collection
+        # Merge the slots of each course first, so each course is only written once
+        slots_by_code = {}
+        teacher_by_code = {}
         for course in courses:
-            db_course = await self.CourseImpl.find_one({"course_code": course.course_code})
-            if db_course is None:
-                db_course = self.CourseImpl(course_code=course.course_code, teacher_name=course.course_teacher_name)
-                # Without this, known_slots for different courses will all point to the same instance of list
-                db_course.known_slots = []
-            else:
-                # Make sure the teacher name is set
-                if not db_course.teacher_name:
-                    db_course.teacher_name = course.course_teacher_name
-            # Fill in known slots
+            slots = slots_by_code.setdefault(course.course_code, [])
             slot_str = f"{course.course_cycle_day}-{course.course_period}"
-            if slot_str not in db_course.known_slots:
-                db_course.known_slots.append(slot_str)
-            await db_course.commit()
-            if db_course.pk not in user.courses:
-                user.courses.append(db_course.pk)
+            if slot_str not in slots:
+                slots.append(slot_str)
+            teacher_by_code.setdefault(course.course_code, course.course_teacher_name)
+        if slots_by_code:
+            # Fields of a new Course document, except for those filled in by the update itself
+            defaults = self.CourseImpl(course_code="").to_mongo()
+            for field in ("_id", "course_code", "known_slots", "teacher_name"):
+                defaults.pop(field, None)
+            ops = []
+            for code, slots in slots_by_code.items():
+                # Create the course if it's new, and fill in known slots
+                ops.append(pymongo.UpdateOne({"course_code": code}, {
+                    "$setOnInsert": {**defaults, "teacher_name": teacher_by_code[code]},
+                    "$addToSet": {"known_slots": {"$each": slots}},
+                }, upsert=True))
+                # Make sure the teacher name is set
+                ops.append(pymongo.UpdateOne({"course_code": code, "teacher_name": {"$in": ["", None]}},
+                    {"$set": {"teacher_name": teacher_by_code[code]}}))
+            await self.CourseImpl.collection.bulk_write(ops)
+            # Only the IDs are needed, in the same order as the timetable
+            ids_by_code = {doc["course_code"]: doc["_id"] async for doc in self.CourseImpl.collection.find(
+                {"course_code": {"$in": list(slots_by_code)}}, {"course_code": True})}
+            for code in slots_by_code:
+                if ids_by_code[code] not in user.courses:
+                    user.courses.append(ids_by_code[code])
         await user.commit()
 
     async def create_user(self) -> str:
@@ -291,14 +309,44 @@ class LockboxDB:
         except ValidationError as e:
             raise LockboxDBError(f"Invalid field: {e}", LockboxDBError.INVALID_FIELD) from e
 
-    async def get_user(self, token: str) -> typing.Dict[str, typing.Any]:
+    async def get_user_public(self, token: str) -> typing.Dict[str, typing.Any]:
         """
-        Get user data as a formatted dict.
+        Get user data that can be given back to the user as a formatted dict.
+
+        The id, token and password are left out, and credentials_set is added
+        to say whether both the login and password are set.
         """
-        user = await self.UserImpl.find_one({"token": token})
+        # Work out credentials_set in the query so the password itself never has to be sent
+        docs = await self.UserImpl.collection.aggregate([
+            {"$match": {"token": token}},
+            {"$limit": 1},
+            {"$addFields": {"credentials_set": {"$and": [
+                {"$ne": [{"$type": "$login"}, "missing"]},
+                {"$ne": [{"$type": "$password"}, "missing"]},
+            ]}}},
+            {"$project": {"_id": False, "token": False, "password": False}},
+        ]).to_list(1)
+        if not docs:
+            raise LockboxDBError("Bad token", LockboxDBError.BAD_TOKEN)
+        credentials_set = docs[0].pop("credentials_set")
+        data = self.UserImpl.build_from_mongo(docs[0]).dump()
+        data["credentials_set"] = credentials_set
+        return data
+
+    async def get_user_courses(self, token: str) -> typing.Dict[str, typing.Any]:
+        """
+        Get whether a user's credentials are set and their courses, without loading the rest of the user.
+
+        Returns a dict with "credentials_set" (bool) and "courses" (a list of course ID strings,
+        or None if they're unset or pending).
+        """
+        user = await self.UserImpl.find_one({"token": token}, {"login": True, "password": True, "courses": True})
         if user is None:
             raise LockboxDBError("Bad token", LockboxDBError.BAD_TOKEN)
-        return user.dump()
+        return {
+            "credentials_set": user.login is not None and user.password is not None,
+            "courses": None if user.courses is None else [str(course) for course in user.courses],
+        }
 
     async def delete_user(self, token: str) -> None:
         """
@@ -314,7 +362,9 @@ class LockboxDB:
                     await self._shared_gridfs.delete(user.last_fill_form_result.form_screenshot_id)
                 except gridfs.NoFile:
                     logger.warning(f"Fill form: Failed to delete previous result form screenshot for user {user.pk}: No file")
-            if user.last_fill_form_result.confirmation_screenshot_id is not None:
+            # Both screenshots could be the same file
+            if user.last_fill_form_result.confirmation_screenshot_id is not None \
+                    and user.last_fill_form_result.confirmation_screenshot_id != user.last_fill_form_result.form_screenshot_id:
                 try:
                     await self._shared_gridfs.delete(user.last_fill_form_result.confirmation_screenshot_id)
                 except gridfs.NoFile:
@@ -356,6 +406,15 @@ class LockboxDB:
         except InvalidToken as e:
             logger.critical(f"User {user.pk}'s password cannot be decrypted")
             raise LockboxDBError("Internal server error: Cannot decrypt password", LockboxDBError.INTERNAL_ERROR) from e
+        # If an update is already waiting to run for this user, it will pick up the same credentials,
+        # so move it up to run now instead of queueing another one
+        # (one that's already running might have used old credentials, so that doesn't count)
+        result = await self.TaskImpl.collection.update_one({"kind": documents.TaskType.POPULATE_COURSES.value,
+            "owner": user.pk, "is_running": False}, {"$min": {"next_run_at": datetime.datetime.utcnow()}})
+        if result.matched_count:
+            logger.info(f"Courses update already pending for user {user.pk}")
+            self._scheduler.update()
+            return
         await self._scheduler.create_task(kind=documents.TaskType.POPULATE_COURSES, owner=user)
 
     async def update_all_courses(self) -> None:
@@ -382,12 +441,16 @@ class LockboxDB:
                 logger.error(f"Update all courses: Invalid interval specified by env var (defaulted to {interval}s): {e}")
         run_at = datetime.datetime.utcnow()
         batch = 0
-        async for user in self.UserImpl.find({"login": {"$ne": None}, "password": {"$ne": None}}):
-            await self._scheduler.create_task(documents.TaskType.POPULATE_COURSES, run_at, user)
+        runs = []
+        # Only the ids are needed to reference the users
+        async for user in self.UserImpl.find({"login": {"$ne": None}, "password": {"$ne": None}}, {"_id": True}):
+            runs.append((run_at, user))
             batch += 1
             if batch >= batch_size:
                 batch = 0
                 run_at += datetime.timedelta(seconds=interval)
+        # Create all the tasks in one write instead of one per user
+        await self._scheduler.create_tasks(documents.TaskType.POPULATE_COURSES, runs)
 
     async def get_form_geometry(self, token: str, url: str, grab_screenshot: bool) -> dict:
         """
@@ -441,11 +504,14 @@ class LockboxDB:
             "status": geom.response_status
         }
 
-    async def get_tasks(self) -> typing.List[dict]:
+    async def iter_tasks(self) -> typing.AsyncIterator[dict]:
         """
-        Get a list of serialized tasks.
+        Iterate over serialized tasks (without their ids).
+
+        Tasks are loaded from the cursor as they are consumed instead of all at once.
         """
-        return [task.dump() async for task in self.TaskImpl.find().sort("next_run_at", 1).sort("retry_count", -1).sort("is_running", -1)]
+        async for task in self.TaskImpl.find({}, {"_id": False}).sort("next_run_at", 1).sort("retry_count", -1).sort("is_running", -1):
+            yield task.dump()
 
     async def find_form_test_context(self, oid: str):
         return await self.FormFillingTestImpl.find_one({"_id": bson.ObjectId(oid)})
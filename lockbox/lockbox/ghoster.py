@@ -8,14 +8,13 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.webdriver.firefox.options import Options
 from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.common.keys import Keys
 from typing import Any, List, Tuple
 
 from .documents import FormFieldType
 import collections
 import datetime
 import enum
+import hashlib
 import logging
 
 logger = logging.getLogger("ghoster")
@@ -23,6 +22,66 @@ logger = logging.getLogger("ghoster")
 # Helper structs
 GhosterCredentials = collections.namedtuple("GhosterCredentials", "email tdsb_user tdsb_pass")
 
+# Selectors for the input element of each text field type
+_TEXT_INPUT_SELECTORS = {
+    FormFieldType.TEXT: "input.quantumWizTextinputPaperinputInput",
+    FormFieldType.LONG_TEXT: "textarea.quantumWizTextinputPapertextareaInput",
+}
+# Class of the clickable options for each choice field type (dropdowns are handled separately)
+_OPTION_CLASSES = {
+    FormFieldType.MULTIPLE_CHOICE: "docssharedWizToggleLabeledLabelWrapper",
+    FormFieldType.CHECKBOX: "quantumWizTogglePapercheckboxInnerBox",
+}
+# Text question subtypes, identified by the class of the input element, in the order they're checked
+_TEXT_SUBTYPE_CLASSES = (
+    ("quantumWizTextinputPaperinputInput", FormFieldType.TEXT),
+    ("quantumWizTextinputPapertextareaInput", FormFieldType.LONG_TEXT),
+)
+# Question root classes that map directly to a field type, in the order they're checked
+_QUESTION_ROOT_CLASSES = (
+    ("freebirdFormviewerComponentsQuestionDateInputsContainer", FormFieldType.DATE),
+    ("freebirdFormviewerComponentsQuestionCheckboxRoot", FormFieldType.CHECKBOX),
+    ("freebirdFormviewerComponentsQuestionSelectRoot", FormFieldType.DROPDOWN),
+)
+
+# Fills in a date question in one call
+# arguments: (question element, month, day, year)
+_FILL_DATE_SCRIPT = """
+const inputs = [...arguments[0].querySelectorAll("input.quantumWizTextinputPaperinputInput")];
+const month = inputs.find(i => i.max === "12");
+const day = inputs.find(i => i.max === "31");
+const year = inputs.find(i => +i.min >= 1000);
+if (!month || !day || !year) {
+    return false;
+}
+for (const [input, value] of [[month, arguments[1]], [day, arguments[2]], [year, arguments[3]]]) {
+    input.focus();
+    input.value = value;
+    input.dispatchEvent(new Event("input", {bubbles: true}));
+    input.dispatchEvent(new Event("change", {bubbles: true}));
+}
+return true;
+"""
+
+# Sets the value of a text input without firing change/blur events, for dry runs
+# arguments: (input element, value)
+_SET_TEXT_SCRIPT = """
+arguments[0].value = arguments[1];
+arguments[0].dispatchEvent(new Event("input", {bubbles: true}));
+"""
+
+# Closes the dropdown popup of the question passed in as the first argument
+# Only that question's popup is removed, since every other dropdown question still needs its own
+_CLOSE_DROPDOWN_SCRIPT = """
+const popup = arguments[0].querySelector("div.exportSelectPopup");
+if (popup) {
+    popup.remove();
+}
+if (document.activeElement) {
+    document.activeElement.blur();
+}
+"""
+
 # Various helper functions for doing common tasks
 def _create_browser():
     options = Options()
@@ -65,6 +124,17 @@ def _do_google_auth_flow(browser: webdriver.Firefox, credentials: GhosterCredent
     #print("clicking login in aw")
 
 
+def _capture(browser: webdriver.Firefox, prev_hash: bytes = None) -> Tuple[Any, bytes]:
+    """
+    Take a screenshot of the whole page.
+
+    Returns (png, hash). If the hash matches prev_hash, the png is None since it's identical to the previous capture.
+    """
+
+    png = browser.find_element_by_tag_name("html").screenshot_as_png
+    digest = hashlib.sha256(png).digest()
+    return (png if digest != prev_hash else None), digest
+
 def _guess_input_type(browser: webdriver.Firefox, element: webdriver.firefox.webelement.FirefoxWebElement): # pylint: disable=unused-argument
     """
     Try to figure out what kind of input this is.
@@ -80,13 +150,11 @@ def _guess_input_type(browser: webdriver.Firefox, element: webdriver.firefox.web
     roots = element.find_elements_by_class_name("freebirdFormviewerComponentsQuestionTextRoot")
     if roots:
         text_root = roots[0]
-        # Check for short answer
-        if text_root.find_elements_by_class_name("quantumWizTextinputPaperinputInput"):
-            return FormFieldType.TEXT
-        elif text_root.find_elements_by_class_name("quantumWizTextinputPapertextareaInput"):
-            return FormFieldType.LONG_TEXT
-        else:
-            return None # unknown text-subtype
+        # Check for short answer, then long answer
+        for class_name, kind in _TEXT_SUBTYPE_CLASSES:
+            if text_root.find_elements_by_class_name(class_name):
+                return kind
+        return None # unknown text-subtype
 
     # Check for radio root
     roots = element.find_elements_by_class_name("freebirdFormviewerComponentsQuestionRadioRoot")
@@ -96,17 +164,10 @@ def _guess_input_type(browser: webdriver.Firefox, element: webdriver.firefox.web
         else:
             return None
 
-    # Check for date input
-    if element.find_elements_by_class_name("freebirdFormviewerComponentsQuestionDateInputsContainer"):
-        return FormFieldType.DATE
-
-    # Check for textbook input
-    if element.find_elements_by_class_name("freebirdFormviewerComponentsQuestionCheckboxRoot"):
-        return FormFieldType.CHECKBOX
-
-    # Check for dropdowns
-    if element.find_elements_by_class_name("freebirdFormviewerComponentsQuestionSelectRoot"):
-        return FormFieldType.DROPDOWN
+    # Check for date inputs, checkboxes and dropdowns
+    for class_name, kind in _QUESTION_ROOT_CLASSES:
+        if element.find_elements_by_class_name(class_name):
+            return kind
 
     # Otherwise explicitly return None
     return None
@@ -144,52 +205,48 @@ class GhosterPossibleFail(GhosterError):
         (error message, screenshot of failing page for manual review)
     """
 
-def _fill_in_field(browser: webdriver.Firefox, element: webdriver.firefox.webelement.FirefoxWebElement, with_value, kind: FormFieldType):
+def _fill_in_field(browser: webdriver.Firefox, element: webdriver.firefox.webelement.FirefoxWebElement, with_value, kind: FormFieldType,
+                   dry_run=False):
     """
     Fill in a field
+
+    If dry_run is set, text is set directly instead of being typed in, since the form won't be submitted.
     """
 
     waiter = WebDriverWait(browser, 4, poll_frequency=0.25)
 
-    if kind in [FormFieldType.TEXT, FormFieldType.LONG_TEXT]:
-        text_field = element.find_element_by_css_selector("input.quantumWizTextinputPaperinputInput" if kind == FormFieldType.TEXT else "textarea.quantumWizTextinputPapertextareaInput")
+    if kind in _TEXT_INPUT_SELECTORS:
+        text_field = element.find_element_by_css_selector(_TEXT_INPUT_SELECTORS[kind])
 
         if not isinstance(with_value, str):
             raise TypeError()
 
-        # wait for the element to be interactable
-        waiter.until(EC.visibility_of(text_field))
+        if dry_run:
+            # only the rendering matters, so skip the wait and the keystrokes
+            browser.execute_script(_SET_TEXT_SCRIPT, text_field, with_value)
+        else:
+            # wait for the element to be interactable
+            waiter.until(EC.visibility_of(text_field))
 
-        text_field.send_keys(with_value)
+            text_field.send_keys(with_value)
 
     elif kind == FormFieldType.DATE:
         if not isinstance(with_value, datetime.date):
             raise TypeError()
 
-        components = element.find_elements_by_css_selector("input.quantumWizTextinputPaperinputInput")
-
-        month = [x for x in components if x.get_attribute("max") == '12'][0]
-        day   = [x for x in components if x.get_attribute("max") == '31'][0]
-        year  = [x for x in components if int(x.get_attribute("min")) >= 1000][0]
+        # find the month/day/year inputs and fill them all in one go, instead of a round trip per input
+        # returns false if any of the three inputs is missing
+        found = browser.execute_script(_FILL_DATE_SCRIPT, element, str(with_value.month), str(with_value.day), str(with_value.year))
 
-        for i in [month, day, year]:
-            waiter.until(EC.visibility_of(i))
-
-        month.send_keys(str(with_value.month))
-        day.send_keys(str(with_value.day))
-        year.send_keys(str(with_value.year))
+        if not found:
+            raise NoSuchElementException("Date field is missing an input")
 
     elif kind in [FormFieldType.MULTIPLE_CHOICE, FormFieldType.DROPDOWN, FormFieldType.CHECKBOX]:
         if not isinstance(with_value, int):
             raise TypeError()
 
-        if kind == FormFieldType.MULTIPLE_CHOICE:
-            options = element.find_elements_by_class_name("docssharedWizToggleLabeledLabelWrapper")
-            waiter.until(EC.visibility_of(options[with_value]))
-            options[with_value].click()
-
-        elif kind == FormFieldType.CHECKBOX:
-            options = element.find_elements_by_class_name("quantumWizTogglePapercheckboxInnerBox")
+        if kind in _OPTION_CLASSES:
+            options = element.find_elements_by_class_name(_OPTION_CLASSES[kind])
             waiter.until(EC.visibility_of(options[with_value]))
             options[with_value].click()
 
@@ -203,18 +260,8 @@ def _fill_in_field(browser: webdriver.Firefox, element: webdriver.firefox.webele
             options = popup.find_elements_by_class_name("exportOption")
             options[with_value + 1].click()  # + 1 for the "Choose" label
 
-            # use actions to send an escape to close it
-            # press escape to close the dropdown
-            actions = ActionChains(browser)
-            actions.send_keys(Keys.ESCAPE)
-            actions.perform()
-
-            # delay until the thing _no longer_ visible
-            try:
-                waiter.until_not(EC.presence_of_element_located((By.CSS_SELECTOR, "div.exportSelectPopup .quantumWizMenuPaperselectOption")))
-            except TimeoutException:
-                # ignore timeouts
-                pass
+            # close the dropdown directly instead of pressing escape and waiting for it to go away
+            browser.execute_script(_CLOSE_DROPDOWN_SCRIPT, element)
 
     else:
         raise NotImplementedError()
@@ -245,8 +292,10 @@ def fill_form(form_url: str, credentials: GhosterCredentials, components: List[T
     ]
 
     Returns two screenshots on success, the first being a picture of the form filled in and the second being a picture of the success screen.
+    If the two screenshots are identical, the same object is returned twice.
 
     If dry_run is set to True, the form will not actually be submitted and both screenshots will be identical.
+    Text fields are also set directly instead of being typed in during a dry run.
     """
 
     with _create_browser() as browser:
@@ -286,7 +335,7 @@ def fill_form(form_url: str, credentials: GhosterCredentials, components: List[T
                     raise GhosterInvalidForm("Requested component (" + expected_title + ") is not present at index (" + str(index) + ")")
 
                 try:
-                    _fill_in_field(browser, sub_elems[index], value, kind)
+                    _fill_in_field(browser, sub_elems[index], value, kind, dry_run=dry_run)
                 except NoSuchElementException as e:
                     raise GhosterInvalidForm("Requested component (" + expected_title + ") is of the wrong type (missing element)") from e
                 except TimeoutException as e:
@@ -308,7 +357,7 @@ def fill_form(form_url: str, credentials: GhosterCredentials, components: List[T
 
 
         # record screenshot of filled in page
-        shot_pre = browser.find_element_by_tag_name("html").screenshot_as_png
+        shot_pre, pre_hash = _capture(browser)
 
         if dry_run:
             # if we're doing a dry run, just return the screenshots
@@ -323,9 +372,10 @@ def fill_form(form_url: str, credentials: GhosterCredentials, components: List[T
         except TimeoutException as e:
             raise GhosterPossibleFail("Timed out waiting for response page", browser.find_element_by_tag_name("html").screenshot_as_png) from e
 
-        shot_post = browser.find_element_by_tag_name("html").screenshot_as_png
+        shot_post, _ = _capture(browser, pre_hash)
 
-        return shot_pre, shot_post, warnings
+        # if nothing changed return the same object so it's only stored once
+        return shot_pre, shot_pre if shot_post is None else shot_post, warnings
 
 
 def get_form_geometry(form_url: str, credentials: GhosterCredentials):
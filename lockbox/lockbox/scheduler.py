@@ -3,7 +3,7 @@ Task scheduler.
 
 The scheduler works by keeping track of tasks in a mongodb collection.
 See documents.Task for the format of task documents.
-The scheduler runs a main loop and spawns asyncio tasks as necessary.
+The scheduler runs a main loop that hands due tasks off to a fixed pool of worker coroutines.
 """
 
 import asyncio
@@ -11,7 +11,7 @@ import datetime
 import logging
 import typing
 import pymongo
-import traceback
+from pymongo.errors import OperationFailure, PyMongoError
 from . import db # pylint: disable=unused-import # For type hinting
 from .documents import TaskType
 
@@ -57,6 +57,48 @@ class TaskTypeGroup:
     def get_groups(cls, kind: TaskType) -> typing.Iterable["TaskTypeGroup"]:
         return cls.GROUPS_MAP.get(kind, ())
 
+    @staticmethod
+    def try_acquire(groups: typing.Sequence["TaskTypeGroup"]) -> typing.Optional["TaskTypeGroup"]:
+        """
+        Reserve a slot in every group in groups (usually all the groups a task type is in).
+
+        Either all groups are reserved or none are. Returns None on success, or the first group that was full.
+        This never yields to the event loop, so no other coroutine can see a partial reservation.
+        """
+        for group in groups:
+            if group.count >= group.limit:
+                return group
+        for group in groups:
+            group.count += 1
+        return None
+
+    @staticmethod
+    def release(groups: typing.Sequence["TaskTypeGroup"]) -> None:
+        """
+        Release the slots reserved by a successful try_acquire().
+        """
+        for group in groups:
+            group.count -= 1
+
+
+class _FormattedTask:
+    """
+    Formats a task document as a string.
+
+    Formatting is deferred until str() is called, so that log messages that are filtered out cost nothing.
+    """
+
+    __slots__ = ("task",)
+
+    def __init__(self, task):
+        self.task = task
+
+    def __str__(self) -> str:
+        s = f"{self.task.kind} scheduled for {self.task.next_run_at}"
+        if self.task.retry_count:
+            s += f" ({self.task.retry_count} retries)"
+        return s
+
 
 class Scheduler:
     """
@@ -68,14 +110,42 @@ class Scheduler:
     # The returned datetime should be in UTC!
     TASK_FUNCS = {}
 
+    # Fields of a task document needed to run it (is_running is already known to be false)
+    _RUN_PROJECTION = {"kind": True, "owner": True, "next_run_at": True, "retry_count": True, "argument": True}
+
+    # Change stream filter for task changes that can affect which task runs next
+    # The main loop's own claims only set is_running, so they don't match
+    _WATCH_PIPELINE = [{"$match": {"$or": [
+        {"operationType": {"$in": ["insert", "replace"]}},
+        {"operationType": "update", "updateDescription.updatedFields.next_run_at": {"$exists": True}},
+    ]}}]
+    # Error code mongo fails a change stream with when it isn't running as a replica set
+    _WATCH_UNSUPPORTED_CODE = 40573
+    # Seconds to wait before restarting the change stream after it fails
+    _WATCH_RETRY_DELAY = 10
+
+    # Maximum number of tasks that can run at once
+    # This is the number of worker coroutines, and also the limit for the global group
+    MAX_RUNNING = 10
+
     def __init__(self, db: "db.LockboxDB"): # pylint: disable=redefined-outer-name
         self._db = db
         self._update_event = asyncio.Event()
+        # Tasks that are due and have passed rate limiting, waiting for a worker to pick them up
+        # Items are (task, groups, owner) where groups are the rate limiting groups reserved for the task
+        # and owner is the task's owner if it was already fetched
+        self._queue = asyncio.Queue()
+        # TASK_FUNCS keyed by the raw kind string stored in task documents, filled in by _init()
+        self._task_funcs_by_str = {}
 
         # Initialize groups
         TaskTypeGroup("firefox", (TaskType.FILL_FORM, TaskType.TEST_FILL_FORM, TaskType.GET_FORM_GEOMETRY), 3)
         TaskTypeGroup("tdsb_connects", (TaskType.FILL_FORM, TaskType.CHECK_DAY, TaskType.POPULATE_COURSES, TaskType.TEST_FILL_FORM), 7)
-        TaskTypeGroup("global", tuple(iter(TaskType)), 10)
+        # Every task is in this group, so it also limits how many tasks can be started at once
+        self._global_group = TaskTypeGroup("global", tuple(iter(TaskType)), self.MAX_RUNNING)
+        # Groups for each task type, keyed by the raw kind string stored in task documents
+        # The groups never change after this, so there's no need to convert kinds to TaskType for every task
+        self._groups_by_kind = {kind.value: tuple(TaskTypeGroup.get_groups(kind)) for kind in TaskType}
 
     def update(self):
         """
@@ -85,72 +155,169 @@ class Scheduler:
         """
         self._update_event.set()
 
-    def _format_task(self, task) -> str:
+    def _format_task(self, task) -> _FormattedTask:
         """
-        Formats a task document as a string.
+        Formats a task document for logging.
+
+        The returned object is only turned into a string if the log message is emitted.
         """
-        s = f"{task.kind} scheduled for {task.next_run_at}"
-        if task.retry_count:
-            s += f" ({task.retry_count} retries)"
-        return s
+        return _FormattedTask(task)
 
     async def _init(self):
         """
         Initialize the scheduler.
 
         Currently reports task that were interrupted, and set all tasks' is_running to false.
+        Also builds the task function lookup, since the handlers are set after the scheduler is created.
+        """
+        self._task_funcs_by_str = {kind.value: func for kind, func in self.TASK_FUNCS.items()}
+        # Covers the main loop's query for the earliest task that isn't running
+        await self._db.TaskImpl.collection.create_index([("is_running", pymongo.ASCENDING), ("next_run_at", pymongo.ASCENDING)])
+        # Covers check day postponing all of today's fill form tasks
+        await self._db.TaskImpl.collection.create_index([("kind", pymongo.ASCENDING), ("next_run_at", pymongo.ASCENDING)])
+        # Covers looking up a user's task of a given kind
+        await self._db.TaskImpl.collection.create_index([("owner", pymongo.ASCENDING), ("kind", pymongo.ASCENDING)])
+        # Only load what's needed to log them
+        async for task in self._db.TaskImpl.find({"is_running": True}, {"kind": True, "next_run_at": True, "retry_count": True}):
+            logger.warning("Detected interrupted task: %s.", self._format_task(task))
+        # Reset them all at once instead of committing each one
+        await self._db.TaskImpl.collection.update_many({"is_running": True}, {"$set": {"is_running": False}})
+
+    async def _patch_task(self, task, **fields):
+        """
+        Set fields on a task document, writing only those fields to the database.
+
+        Field names are used as-is in the update, so they must match the names stored in mongo.
         """
-        async for task in self._db.TaskImpl.find({"is_running": True}):
-            logger.warning(f"Detected interrupted task: {self._format_task(task)}.")
-            task.is_running = False
-            await task.commit()
+        for name, value in fields.items():
+            setattr(task, name, value)
+        await self._db.TaskImpl.collection.update_one({"_id": task.pk}, {"$set": fields})
 
-    async def _run_task(self, task):
+    async def _run_task(self, task, owner=None):
         """
         Run a specific task (given as a mongo Document).
+
+        If the task's owner has already been fetched, it can be passed in to skip fetching it again.
         """
-        if task.owner is not None:
+        if owner is None and task.owner is not None:
             owner = await task.owner.fetch()
-        else:
-            owner = None
-        logger.info(f"Starting task {self._format_task(task)}")
+        logger.info("Starting task %s", self._format_task(task))
         # Run task
         try:
-            next_run = await self.TASK_FUNCS[TaskType(task.kind)](self._db, owner, task.retry_count, task.argument)
+            next_run = await self._task_funcs_by_str[task.kind](self._db, owner, task.retry_count, task.argument)
             # Task success, reset retries
             task.retry_count = 0
         except TaskError as e:
             if e.retry_in is not None:
-                logger.warning(f"Task {self._format_task(task)} failed, retrying in {e.retry_in}s: {e}")
+                logger.warning("Task %s failed, retrying in %ss: %s", self._format_task(task), e.retry_in, e)
                 # Set next retry time and increase retry count
                 next_run = datetime.datetime.utcnow() + datetime.timedelta(seconds=e.retry_in)
                 task.retry_count += 1
             else:
-                logger.warning(f"Task {self._format_task(task)} failed, not retrying: {e}")
+                logger.warning("Task %s failed, not retrying: %s", self._format_task(task), e)
                 # If no retry time given, task is deleted
                 next_run = None
         except Exception: # pylint: disable=broad-except
-            logger.critical(f"Task {self._format_task(task)} threw an unhandled error. Removing it from the database.")
-            await task.remove()
+            logger.critical("Task %s threw an unhandled error. Removing it from the database.", self._format_task(task))
+            await self._db.TaskImpl.collection.delete_one({"_id": task.pk})
             # log stracktrace
-            logger.error("Exception traceback:\n" + traceback.format_exc())
+            logger.error("Exception traceback:", exc_info=True)
             return
-        # Update rate limiting counters
-        for group in TaskTypeGroup.get_groups(TaskType(task.kind)):
-            if group.count > 0:
-                group.count -= 1
-            else:
-                logger.error(f"Inconsistent rate limiting count detected for group {group.name} ({self._format_task(task)})")
         # Update task if next run time is provided
+        # Only the changed fields are written, in a single update
         if next_run is not None:
-            task.next_run_at = next_run
-            task.is_running = False
-            await task.commit()
+            await self._patch_task(task, next_run_at=next_run, is_running=False, retry_count=task.retry_count)
             self.update()
-            logger.info(f"Task rescheduled: {self._format_task(task)}")
+            logger.info("Task rescheduled: %s", self._format_task(task))
         else:
-            logger.info(f"Task success (deleted): {self._format_task(task)}")
-            await task.remove()
+            logger.info("Task success (deleted): %s", self._format_task(task))
+            await self._db.TaskImpl.collection.delete_one({"_id": task.pk})
+
+    async def _worker(self):
+        """
+        Worker loop.
+
+        Takes tasks off the queue filled by the main scheduling loop and runs them one after another.
+        Releases the rate limiting slots reserved by the main loop once each task is done, however it ends.
+        """
+        try:
+            while True:
+                task, groups, owner = await self._queue.get()
+                try:
+                    await self._run_task(task, owner)
+                # On Python 3.7 (which the image runs) CancelledError is still an Exception,
+                # so it has to be let through before the catch-all below or the worker could never be stopped
+                except asyncio.CancelledError: # pylint: disable=try-except-raise
+                    raise
+                except Exception: # pylint: disable=broad-except
+                    # Don't let a db error take down the worker
+                    logger.error("Worker failed to run task %s:", self._format_task(task), exc_info=True)
+                finally:
+                    TaskTypeGroup.release(groups)
+        except asyncio.CancelledError:
+            pass
+
+    async def _dispatch_due(self) -> typing.Tuple[bool, typing.Optional[datetime.datetime]]:
+        """
+        Hand every task that is due off to the workers, as far as the rate limits allow.
+
+        Due tasks that are over a rate limit are pushed back 30s.
+        Claiming and pushing back each take one write for the whole batch instead of one per task.
+
+        Returns whether any due tasks were found, and when the earliest task that isn't due yet is scheduled.
+        The same query reads one task past the due ones, so the main loop knows how long to wait without asking again.
+        The scheduled time is None if there are no such tasks, or if the query stopped before reaching them.
+        """
+        now = datetime.datetime.utcnow()
+        # Only if the task is late by more than 100ms
+        # Since we don't want warnings for tasks that were scheduled to run immediately
+        late_cutoff = now - datetime.timedelta(seconds=0.1)
+        # No more than this many tasks can start right now
+        # Always look at at least one, so that a blocked task still gets pushed back
+        limit = max(self._global_group.limit - self._global_group.count, 1)
+        claimed = []
+        pushed_back = []
+        next_run_at = None
+        async for task in self._db.TaskImpl.find({"is_running": False}, self._RUN_PROJECTION,
+                                                 sort=[("next_run_at", pymongo.ASCENDING)]).limit(limit + 1):
+            if task.next_run_at > now:
+                next_run_at = task.next_run_at
+                break
+            # One more task than the limit was read, to find the next one that isn't due
+            # If that task is also due, just leave it for the next pass
+            if len(claimed) + len(pushed_back) >= limit:
+                break
+            # Compare datetimes directly, and only work out how late the task is if it's going to be logged
+            if task.next_run_at < late_cutoff:
+                logger.warning("Late task: %s (late %ss).", self._format_task(task), (now - task.next_run_at).total_seconds())
+            # Check and increase rate limiting counters first
+            groups = self._groups_by_kind.get(task.kind, ())
+            full_group = TaskTypeGroup.try_acquire(groups)
+            if full_group is not None:
+                logger.warning("Task %s pushed back 30s because the rate limit for group %s was reached (%s)", self._format_task(task), full_group.name, full_group.limit)
+                pushed_back.append(task)
+            # All groups' requirements were met
+            else:
+                claimed.append((task, groups))
+        if pushed_back:
+            # Pushed back from now rather than from the scheduled time, so that very late tasks don't come right back
+            await self._db.TaskImpl.collection.update_many({"_id": {"$in": [task.pk for task in pushed_back]}},
+                {"$set": {"next_run_at": now + datetime.timedelta(seconds=30)}})
+        if claimed:
+            # Mark as running here before handing them to the workers
+            await self._db.TaskImpl.collection.update_many({"_id": {"$in": [task.pk for task, _ in claimed]}},
+                {"$set": {"is_running": True}})
+            # Fetch the owners of the whole batch in one query instead of one per task
+            owner_ids = list({task.owner.pk for task, _ in claimed if task.owner is not None})
+            owners = {}
+            if owner_ids:
+                async for owner in self._db.UserImpl.find({"_id": {"$in": owner_ids}}):
+                    owners[owner.pk] = owner
+            for task, groups in claimed:
+                task.is_running = True
+                # Owners that weren't found are left to _run_task() to fetch (and fail on)
+                self._queue.put_nowait((task, groups, owners.get(task.owner.pk) if task.owner is not None else None))
+        return bool(claimed or pushed_back), next_run_at
 
     async def _run(self):
         """
@@ -158,42 +325,50 @@ class Scheduler:
         """
         try:
             while True:
-                # Find earliest scheduled task
-                task = await self._db.TaskImpl.find_one({"is_running": False}, sort=[("next_run_at", pymongo.ASCENDING)])
-                # Calculate the amount of time to wait until the next task should execute
+                # Clear the update event before querying, so an update made while a query is in flight still wakes us
+                self._update_event.clear()
+                # Start everything that's due
+                # If anything was found, check again right away since there might be more
+                found, next_run_at = await self._dispatch_due()
+                if found:
+                    continue
+                # Nothing is due, so wait until the earliest scheduled task (found by the same query)
                 # If no next task exists, wait forever
-                if task is None:
+                if next_run_at is None:
                     timeout = None
                 else:
-                    # Calculate time to wait from the scheduled time of the task
-                    timeout = (task.next_run_at - datetime.datetime.utcnow()).total_seconds()
-                    # Only if the task is late by more than 100ms
-                    # Since we don't want warnings for tasks that were scheduled to run immediately
-                    if -timeout > 0.1:
-                        logger.warning(f"Late task: {self._format_task(task)} (late {-timeout}s).")
-                    timeout = max(timeout, 0)
+                    timeout = max((next_run_at - datetime.datetime.utcnow()).total_seconds(), 0)
                 try:
                     await asyncio.wait_for(self._update_event.wait(), timeout)
-                    # If wait_for() did not time out, then the update event must be set so check again for a new task
-                    self._update_event.clear()
-                    continue
+                    # If wait_for() did not time out, then the update event must be set so check again for new tasks
                 except asyncio.TimeoutError:
-                    # If wait_for() timed out then we've waited the right amount of time to schedule the task
-                    # Check rate limiting counters first
-                    for group in TaskTypeGroup.get_groups(TaskType(task.kind)):
-                        if group.count >= group.limit:
-                            task.next_run_at += datetime.timedelta(seconds=30)
-                            logger.warning(f"Task {self._format_task(task)} pushed back 30s because the rate limit for group {group.name} was reached ({group.limit})")
-                            await task.commit()
-                            break
-                    # If didn't break, then all groups' requirements were met
-                    else:
-                        # Increase rate limiting counters and mark as running here since create_task() doesn't force context switch
-                        for group in TaskTypeGroup.get_groups(TaskType(task.kind)):
-                            group.count += 1
-                        task.is_running = True
-                        await task.commit()
-                        asyncio.create_task(self._run_task(task))
+                    # If wait_for() timed out then we've waited the right amount of time and the task is due
+                    pass
+        except asyncio.CancelledError:
+            pass
+
+    async def _watch_changes(self):
+        """
+        Wake up the main loop when tasks are created or rescheduled by anything, including other processes.
+
+        Change streams need mongo to be running as a replica set. If they're not supported,
+        update() will be the only thing that wakes up the main loop.
+        Any other error (e.g. a network error or a failover) restarts the stream after a delay.
+        """
+        try:
+            while True:
+                try:
+                    async with self._db.TaskImpl.collection.watch(self._WATCH_PIPELINE) as stream:
+                        # Tasks may have changed while the stream wasn't open
+                        self._update_event.set()
+                        async for _ in stream:
+                            self._update_event.set()
+                except PyMongoError as e:
+                    if isinstance(e, OperationFailure) and e.code == self._WATCH_UNSUPPORTED_CODE:
+                        logger.info("Not watching the task collection for changes (change streams not supported): %s", e)
+                        return
+                    logger.error("Watching the task collection for changes failed, restarting in %ss:", self._WATCH_RETRY_DELAY, exc_info=True)
+                await asyncio.sleep(self._WATCH_RETRY_DELAY)
         except asyncio.CancelledError:
             pass
 
@@ -201,12 +376,15 @@ class Scheduler:
         """
         Start the task scheduler.
 
-        The main scheduling loop is started as an asyncio task.
+        The main scheduling loop, the workers and the change stream watcher are started as asyncio tasks.
 
         This method should only ever be called ONCE on startup.
         Subsequent calls may spawn more scheduling loops, causing unintended side effects.
         """
         await self._init()
+        for _ in range(self.MAX_RUNNING):
+            asyncio.create_task(self._worker())
+        asyncio.create_task(self._watch_changes())
         asyncio.create_task(self._run())
 
     async def create_task(self, kind: TaskType, run_at: typing.Optional[datetime.datetime] = None,
@@ -228,3 +406,26 @@ class Scheduler:
         await task.commit()
         self.update()
         return task
+
+    async def create_tasks(self, kind: TaskType, runs: typing.Iterable[typing.Tuple[datetime.datetime, typing.Optional[typing.Any]]]) -> int:
+        """
+        Create many tasks of the same kind at once.
+
+        runs is an iterable of (run_at, owner) pairs, with the same meaning as in create_task().
+        All tasks are written in one insert, and the owners are not checked to exist, so they should
+        come straight from the database.
+
+        Returns the number of tasks created.
+        """
+        docs = []
+        for run_at, owner in runs:
+            task = self._db.TaskImpl(kind=kind.value, next_run_at=run_at or datetime.datetime.utcnow())
+            if owner is not None:
+                task.owner = owner
+            task.required_validate()
+            docs.append(task.to_mongo())
+        if not docs:
+            return 0
+        await self._db.TaskImpl.collection.insert_many(docs, ordered=False)
+        self.update()
+        return len(docs)
@@ -3,70 +3,130 @@ Main server implementation.
 """
 
 import functools
-import json
 import logging
+import re
+import typing
+import orjson
 from aiohttp import web
+from aiohttp.abc import AbstractAccessLogger
 from .db import LockboxDB, LockboxDBError
 
 
 logger = logging.getLogger("server")
 
 
-def _extract_token(handler):
+def _json_body_response(body: bytes, status: int = 200) -> web.Response:
     """
-    Use this decorator on web handlers to require token auth and extract the token.
+    Create a JSON response from an already encoded body.
     """
-    @functools.wraps(handler)
-    async def _handler(self, request: web.Request, *args, **kwargs):
-        if "authorization" not in request.headers:
-            return web.json_response({"error": "Missing token"}, status=401)
-        auth_parts = request.headers["authorization"].split(" ")
-        if len(auth_parts) != 2 or auth_parts[0].lower() != "bearer":
-            return web.json_response({"error": "Bearer auth not used"}, status=401)
-        token = auth_parts[1]
-        return await handler(self, request, token=token, *args, **kwargs)
-    return _handler
-
-
-def _handle_db_errors(handler):
+    return web.Response(body=body, status=status, content_type="application/json")
+
+
+def _json_response(data: typing.Any, status: int = 200) -> web.Response:
+    """
+    Create a JSON response, like web.json_response() but encoded with orjson.
+    """
+    return _json_body_response(orjson.dumps(data), status)
+
+
+# Tokens are generated by secrets.token_hex(32)
+_TOKEN_FORMAT = re.compile(r"[0-9a-f]{64}")
+
+# Content types accepted for JSON payloads
+_JSON_CONTENT_TYPES = frozenset(("application/json", "text/json"))
+
+# Fields of a user that can be set through PATCH /user
+_MODIFIABLE_USER_FIELDS = frozenset(("login", "password", "active", "grade", "first_name", "last_name"))
+
+# Largest JSON payload accepted by any endpoint
+# All payloads are a handful of short fields, so anything bigger is rejected without reading it
+_MAX_JSON_PAYLOAD_SIZE = 16 * 1024
+
+# Constant response bodies, encoded once
+_ERROR_MISSING_TOKEN = orjson.dumps({"error": "Missing token"})
+_ERROR_BEARER_NOT_USED = orjson.dumps({"error": "Bearer auth not used"})
+_ERROR_BAD_TOKEN = orjson.dumps({"error": "Bad token"})
+_ERROR_MISSING_BODY = orjson.dumps({"error": "Missing body"})
+_ERROR_BAD_CONTENT_TYPE = orjson.dumps({"error": "Bad content type"})
+_ERROR_PAYLOAD_TOO_LARGE = orjson.dumps({"error": "Payload too large"})
+_ERROR_PAYLOAD_NOT_OBJECT = orjson.dumps({"error": "Payload must be an object"})
+_ERROR_MISSING_URL = orjson.dumps({"error": "Missing field: 'url'"})
+_ERROR_MISSING_TEST_SETUP_ID = orjson.dumps({"error": "Missing field: 'test_setup_id'"})
+_ERROR_TEST_ALREADY_STARTED = orjson.dumps({"error": "already in progress or already finished"})
+_COURSES_NO_CREDENTIALS = orjson.dumps({"courses": None, "pending": False})
+_COURSES_PENDING = orjson.dumps({"courses": None, "pending": True})
+
+
+# HTTP status codes for each LockboxDBError code
+_DB_ERROR_STATUS = {
+    LockboxDBError.BAD_TOKEN: 401,              # Unauthorized
+    LockboxDBError.INVALID_FIELD: 400,          # Bad Request
+    LockboxDBError.INTERNAL_ERROR: 500,         # Internal Server Error
+    LockboxDBError.STATE_CONFLICT: 409,         # Conflict
+    LockboxDBError.RATE_LIMIT_EXCEEDED: 429,    # Too Many Requests
+    LockboxDBError.OTHER: 400,                  # Bad Request
+}
+
+
+def _endpoint(auth: bool = False, json_payload: bool = False):
     """
-    Use this decorator to handle LockboxDBErrors and return an http response.
+    Use this decorator on web handlers to handle LockboxDBErrors and return an http response.
+
+    If auth is true, token auth is required and the token is passed to the handler as the token argument.
+    If json_payload is true, the payload is verified to be JSON, downloaded and passed as the payload argument.
+
+    All of this is done in one wrapper, so a request only goes through one extra coroutine.
     """
-    @functools.wraps(handler)
-    async def _handler(*args, **kwargs):
-        try:
-            response = await handler(*args, **kwargs)
-            return response
-        except LockboxDBError as e:
-            code = {
-                LockboxDBError.BAD_TOKEN: 401,              # Unauthorized
-                LockboxDBError.INVALID_FIELD: 400,          # Bad Request
-                LockboxDBError.INTERNAL_ERROR: 500,         # Internal Server Error
-                LockboxDBError.STATE_CONFLICT: 409,         # Conflict
-                LockboxDBError.RATE_LIMIT_EXCEEDED: 429,    # Too Many Requests
-                LockboxDBError.OTHER: 400,                  # Bad Request
-            }[e.code]
-            logger.info(f"Responded with error {code}: {str(e)}")
-            return web.json_response({"error": str(e)}, status=code)
-    return _handler
-
-
-def _json_payload(handler):
+    def _decorator(handler):
+        @functools.wraps(handler)
+        async def _handler(self, request: web.Request):
+            kwargs = {}
+            # Check auth first so that the body isn't read for unauthorized requests
+            if auth:
+                auth_header = request.headers.get("authorization")
+                if auth_header is None:
+                    return _json_body_response(_ERROR_MISSING_TOKEN, status=401)
+                # Must be exactly "Bearer <token>" (scheme is case-insensitive)
+                if auth_header[:7].lower() != "bearer " or " " in auth_header[7:]:
+                    return _json_body_response(_ERROR_BEARER_NOT_USED, status=401)
+                token = auth_header[7:]
+                # A token that can't exist can't match any user, so don't bother looking it up
+                if _TOKEN_FORMAT.fullmatch(token) is None:
+                    return _json_body_response(_ERROR_BAD_TOKEN, status=401)
+                kwargs["token"] = token
+            if json_payload:
+                if not request.can_read_body:
+                    return _json_body_response(_ERROR_MISSING_BODY, status=400)
+                if request.content_type not in _JSON_CONTENT_TYPES:
+                    return _json_body_response(_ERROR_BAD_CONTENT_TYPE, status=400)
+                # Chunked bodies have no length, but are still capped by the app's client_max_size when read
+                if request.content_length is not None and request.content_length > _MAX_JSON_PAYLOAD_SIZE:
+                    return _json_body_response(_ERROR_PAYLOAD_TOO_LARGE, status=413)
+                try:
+                    kwargs["payload"] = orjson.loads(await request.read())
+                except orjson.JSONDecodeError as e:
+                    return _json_response({"error": f"Invalid json: {e}"}, status=400)
+            try:
+                return await handler(self, request, **kwargs)
+            except LockboxDBError as e:
+                code = _DB_ERROR_STATUS[e.code]
+                logger.info("Responded with error %s: %s", code, e)
+                return _json_response({"error": str(e)}, status=code)
+        return _handler
+    return _decorator
+
+
+class _AccessLogger(AbstractAccessLogger):
     """
-    Use this decorator to verify that the payload is JSON and download it.
+    Access logger that only logs the remote address, method, path and response status.
+
+    The time comes from the access log handler's formatter.
+
+    The default access logger formats a dozen fields per request, most of which lockbox doesn't need.
     """
-    @functools.wraps(handler)
-    async def _handler(self, request: web.Request, *args, **kwargs):
-        if not request.can_read_body:
-            return web.json_response({"error": "Missing body"}, status=400)
-        if not request.content_type in ("application/json", "text/json"):
-            return web.json_response({"error": "Bad content type"}, status=400)
-        try:
-            data = await request.json()
-        except json.JSONDecodeError as e:
-            return web.json_response({"error": f"Invalid json: {e}"}, status=400)
-        return await handler(self, request, payload=data, *args, **kwargs)
-    return _handler
+
+    def log(self, request: web.BaseRequest, response: web.StreamResponse, time: float) -> None:
+        self.logger.info("%s %s %s %s", request.remote, request.method, request.path, response.status)
 
 
 class LockboxServer:
@@ -74,14 +134,19 @@ class LockboxServer:
     Main server class.
     """
 
+    __slots__ = ("app", "db", "_db_host", "_db_port")
+
     def __init__(self, **kwargs):
+        # run_app() can't set the keep-alive timeout, so it's passed to the request handlers through the app instead
+        # Idle keep-alive connections are closed sooner than the 75s default
+        kwargs.setdefault("handler_args", {"keepalive_timeout": 15})
         self.app = web.Application(**kwargs)
         self.app.router.add_routes([
             web.post("/user", self._post_user),
             web.patch("/user", self._patch_user),
             web.get("/user", self._get_user),
             web.delete("/user", self._delete_user),
-            web.delete(r"/user/error/{id:[a-f0-9]+}", self._delete_user_error),
+            web.delete("/user/error/{id}", self._delete_user_error),
             web.get("/user/courses", self._get_user_courses),
             web.post("/user/courses/update", self._post_user_courses_update),
             web.post("/form_geometry", self._post_form_geometry),
@@ -91,13 +156,23 @@ class LockboxServer:
             web.post("/test_form", self._post_test_form)
         ])
 
-        self.db = LockboxDB("db", 27017)
+        self._db_host = "db"
+        self._db_port = 27017
+        # Created by make_app(), once the event loop is running
+        self.db = None # type: LockboxDB
 
     async def make_app(self):
         """
         Perform async initialization for the app.
+
+        The database (and its one mongo client) is created here, so that it belongs to the loop the app runs on.
+        Calling this again reuses the same database.
         """
-        await self.db.init()
+        if self.db is None:
+            # Keep some connections open so requests don't have to wait for a new one,
+            # but far fewer than the default of 100 since everything runs on one event loop
+            self.db = LockboxDB(self._db_host, self._db_port, min_pool_size=10, max_pool_size=50, max_idle_time_ms=300000)
+            await self.db.init()
         return self.app
 
     def run(self):
@@ -107,9 +182,11 @@ class LockboxServer:
         Does not return until the server is killed.
         """
 
-        web.run_app(self.make_app(), host="0.0.0.0", port=80)
+        # aiohttp already turns on TCP_NODELAY for every connection
+        # The backlog is raised to absorb bursts
+        web.run_app(self.make_app(), host="0.0.0.0", port=80, access_log_class=_AccessLogger, backlog=2048)
 
-    @_handle_db_errors
+    @_endpoint()
     async def _post_user(self, request: web.Request): # pylint: disable=unused-argument
         """
         Handle a POST to /user.
@@ -122,11 +199,9 @@ class LockboxServer:
         }
         """
         token = await self.db.create_user()
-        return web.json_response({"token": token}, status=200)
+        return _json_response({"token": token}, status=200)
 
-    @_handle_db_errors
-    @_json_payload
-    @_extract_token
+    @_endpoint(auth=True, json_payload=True)
     async def _patch_user(self, request: web.Request, token: str, payload: dict): # pylint: disable=unused-argument
         """
         Handle a PATCH to /user.
@@ -152,12 +227,17 @@ class LockboxServer:
 
         Possible error response codes:
         - 400: Invalid format, token, or field value (including TDSB credentials)
+        - 413: Payload too large
         """
-        await self.db.modify_user(token, **payload)
+        # Anything other than an object can't be passed on as fields
+        if not isinstance(payload, dict):
+            return _json_body_response(_ERROR_PAYLOAD_NOT_OBJECT, status=400)
+        # Other keys are ignored, and must not be passed on since some (e.g. "token") are modify_user()'s own arguments
+        fields = {k: v for k, v in payload.items() if k in _MODIFIABLE_USER_FIELDS}
+        await self.db.modify_user(token, **fields)
         return web.Response(status=204)
 
-    @_handle_db_errors
-    @_extract_token
+    @_endpoint(auth=True)
     async def _get_user(self, request: web.Request, token): # pylint: disable=unused-argument
         """
         Handle a GET to /user.
@@ -197,16 +277,9 @@ class LockboxServer:
         Possible error response codes:
         - 401: Invalid token
         """
-        data = await self.db.get_user(token)
-        # Modify data
-        data["credentials_set"] = "password" in data and "login" in data
-        data.pop("id", None)
-        data.pop("password", None)
-        data.pop("token", None)
-        return web.json_response(data, status=200)
-
-    @_handle_db_errors
-    @_extract_token
+        return _json_response(await self.db.get_user_public(token), status=200)
+
+    @_endpoint(auth=True)
     async def _delete_user(self, request: web.Request, token: str): # pylint: disable=unused-argument
         """
         Handle a DELETE to /user.
@@ -226,8 +299,7 @@ class LockboxServer:
         await self.db.delete_user(token)
         return web.Response(status=204)
 
-    @_handle_db_errors
-    @_extract_token
+    @_endpoint(auth=True)
     async def _delete_user_error(self, request: web.Request, token: str):
         """
         Handle a DELETE to /user/error/<id>.
@@ -248,8 +320,7 @@ class LockboxServer:
         await self.db.delete_user_error(token, request.match_info["id"])
         return web.Response(status=204)
 
-    @_handle_db_errors
-    @_extract_token
+    @_endpoint(auth=True)
     async def _get_user_courses(self, request: web.Request, token: str): # pylint: disable=unused-argument
         """
         Handle a GET to /user/courses.
@@ -273,20 +344,19 @@ class LockboxServer:
         Possible error response codes:
         - 401: Invalid token
         """
-        data = await self.db.get_user(token)
+        data = await self.db.get_user_courses(token)
         # No credentials
-        if not ("password" in data and "login" in data):
+        if not data["credentials_set"]:
             logger.info("User credentials not present")
-            return web.json_response({"courses": None, "pending": False})
+            return _json_body_response(_COURSES_NO_CREDENTIALS)
         # Credentials present, but courses are not
         if data.get("courses") is None:
             logger.info("User courses pending")
-            return web.json_response({"courses": None, "pending": True})
+            return _json_body_response(_COURSES_PENDING)
         # Both present
-        return web.json_response({"courses": data["courses"], "pending": False})
+        return _json_response({"courses": data["courses"], "pending": False})
 
-    @_handle_db_errors
-    @_extract_token
+    @_endpoint(auth=True)
     async def _post_user_courses_update(self, request: web.Request, token: str): # pylint: disable=unused-argument
         """
         Handle a POST to /user/courses/update.
@@ -308,9 +378,7 @@ class LockboxServer:
         await self.db.update_user_courses(token)
         return web.Response(status=204)
 
-    @_handle_db_errors
-    @_json_payload
-    @_extract_token
+    @_endpoint(auth=True, json_payload=True)
     async def _post_form_geometry(self, request: web.Request, token: str, payload: dict): # pylint: disable=unused-argument
         """
         Handle a POST to /form_geometry.
@@ -351,23 +419,22 @@ class LockboxServer:
         - 400: Invalid field, invalid form
         - 401: Invalid token
         - 403: Form auth error
+        - 413: Payload too large
         - 429: Concurrent request limit exceeded # Not in use at the moment
         - 409: Cannot sign into form due to missing credentials
         """
         if "url" not in payload:
-            return web.json_response({"error": "Missing field: 'url'"}, status=400)
+            return _json_body_response(_ERROR_MISSING_URL, status=400)
         result = await self.db.get_form_geometry(token, payload["url"], payload.get("grab_screenshot", False))
         result["pending"] = result["geometry"] is None
         if "status" in result:
             status = result.pop("status")
-            logger.info(f"Form geometry error {status}: {result['error']}")
-            return web.json_response(result, status=status)
+            logger.info("Form geometry error %s: %s", status, result["error"])
+            return _json_response(result, status=status)
         else:
-            return web.json_response(result, status=200)
+            return _json_response(result, status=200)
 
-    @_handle_db_errors
-    @_json_payload
-    @_extract_token
+    @_endpoint(auth=True, json_payload=True)
     async def _post_test_form(self, request: web.Request, token: str, payload: dict): # pylint: disable=unused-argument
         """
         Handle a POST to /test_form.
@@ -385,15 +452,16 @@ class LockboxServer:
         - 400: Invalid field, invalid form
         - 401: Invalid token
         - 409: Setup already tested / in progress
+        - 413: Payload too large
         """
 
         if "test_setup_id" not in payload:
-            return web.json_response({"error": "Missing field: 'test_setup_id'"}, status=400)
+            return _json_body_response(_ERROR_MISSING_TEST_SETUP_ID, status=400)
 
         # Check if the request was already finished
         context = await self.db.find_form_test_context(payload["test_setup_id"])
         if context.is_finished or context.is_scheduled:
-            return web.json_response({"error": "already in progress or already finished"}, status=409)
+            return _json_body_response(_ERROR_TEST_ALREADY_STARTED, status=409)
         else:
             # start a task
             await self.db.start_form_test(payload["test_setup_id"], token)
@@ -402,7 +470,7 @@ class LockboxServer:
 
             return web.Response(status=204)
 
-    @_handle_db_errors
+    @_endpoint()
     async def _post_update_all_courses(self, request: web.Request): # pylint: disable=unused-argument
         """
         Handle a POST to /update_all_courses. Equivalent to POSTing to /user/courses/update for ALL users.
@@ -417,7 +485,7 @@ class LockboxServer:
         await self.db.update_all_courses()
         return web.Response(status=204)
 
-    @_handle_db_errors
+    @_endpoint()
     async def _get_debug_tasks(self, request: web.Request): # pylint: disable=unused-argument
         """
         Handle a GET to /debug/tasks. For debug purposes.
@@ -435,10 +503,17 @@ class LockboxServer:
             ]
         }
         """
-        tasks = await self.db.get_tasks()
-        for task in tasks:
-            task.pop("id", None)
-        return web.json_response({"tasks": tasks}, status=200)
+        # Write tasks out as they come from the database instead of building the whole list first
+        response = web.StreamResponse(status=200)
+        response.content_type = "application/json"
+        await response.prepare(request)
+        await response.write(b'{"tasks":[')
+        separator = b""
+        async for task in self.db.iter_tasks():
+            await response.write(separator + orjson.dumps(task))
+            separator = b","
+        await response.write(b"]}")
+        return response
 
     async def _post_debug_tasks_update(self, request: web.Request): # pylint: disable=unused-argument
         """
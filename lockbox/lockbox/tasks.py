@@ -103,7 +103,7 @@ async def check_day(db: "db_.LockboxDB", owner, retries: int, argument: str) ->
         try:
             password = db.fernet.decrypt(user.password).decode("utf-8")
         except InvalidToken:
-            logger.critical(f"User {user.pk}'s password cannot be decrypted")
+            logger.critical("User %s's password cannot be decrypted", user.pk)
             continue
         # Attempt login
         session = tdsbconnects.TDSBConnects()
@@ -118,12 +118,12 @@ async def check_day(db: "db_.LockboxDB", owner, retries: int, argument: str) ->
                         school = s
                         break
                 else:
-                    logger.warning(f"User {user.pk} is not in the correct school")
+                    logger.warning("User %s is not in the correct school", user.pk)
                     # Skip if not in the correct school
                     continue
             else:
                 if len(schools) != 1:
-                    logger.warning(f"User {user.pk} is in {len(schools)} schools")
+                    logger.warning("User %s is in %s schools", user.pk, len(schools))
                     continue
                 school = schools[0]
             days = await school.day_cycle_names(datetime.datetime.today(), datetime.datetime.today())
@@ -133,7 +133,7 @@ async def check_day(db: "db_.LockboxDB", owner, retries: int, argument: str) ->
             break
         except aiohttp.ClientError as e:
             if not (isinstance(e, aiohttp.ClientResponseError) and e.code == 401): # pylint: disable=no-member
-                logger.warning(f"Check day: Non-auth error when trying to login as {user.login}: {e}")
+                logger.warning("Check day: Non-auth error when trying to login as %s: %s", user.login, e)
             continue
         finally:
             await session.close()
@@ -151,7 +151,7 @@ async def check_day(db: "db_.LockboxDB", owner, retries: int, argument: str) ->
     # There is school
     if len(day) >= 2:
         db.current_day = int(day[1:])
-        logger.info(f"Check day: Current school day is a Day {db.current_day}")
+        logger.info("Check day: Current school day is a Day %s", db.current_day)
     else:
         logger.info("Check day: No school today.")
         # No school today
@@ -164,7 +164,7 @@ async def check_day(db: "db_.LockboxDB", owner, retries: int, argument: str) ->
         result = await db.TaskImpl.collection.update_many({"kind": TaskType.FILL_FORM.value,
                 "next_run_at": {"$gte": start, "$lt": end}},
             [{"$set": {"next_run_at": {"$add": ["$next_run_at", 24 * 60 * 60 * 1000]}}}])
-        logger.info(f"Check day: {result.modified_count} tasks modified.")
+        logger.info("Check day: %s tasks modified.", result.modified_count)
     return next_run
 
 
@@ -187,12 +187,12 @@ async def _get_tdsb_user_info(db: "db_.LockboxDB", user, password: str, warn_cb:
                         school = s
                         break
                 else:
-                    logger.error(f"{log_prefix}: User {user.pk} is not in the right school")
+                    logger.error("%s: User %s is not in the right school", log_prefix, user.pk)
                     raise LockboxTaskFailure(LockboxFailureType.BAD_USER_INFO, f"You don't seem to be in the school nffu was set up for (#{db.school_code}).")
             else:
                 schools = info.schools
                 if len(schools) != 1:
-                    logger.error(f"{log_prefix}: User {user.pk} has an invalid number of schools: {', '.join(f'{s.name} (#{s.code})' for s in schools)}")
+                    logger.error("%s: User %s has an invalid number of schools: %s", log_prefix, user.pk, ", ".join(f"{s.name} (#{s.code})" for s in schools))
                     raise LockboxTaskFailure(LockboxFailureType.BAD_USER_INFO, f"TDSB reported that you're in {len(schools)} schools. NFFU only works if you have exactly 1 school.")
                 school = schools[0]
             # Get only async courses today
@@ -229,14 +229,14 @@ async def _get_fieldexpr_context(db: "db_.LockboxDB", user, course, info: typing
                 if not first_name or not last_name:
                     raise ValueError()
             except (ValueError, IndexError, KeyError):
-                logger.warning(f"{log_prefix}: No stored names for user {user.pk} and TDSB Connects does not contain first/last name. Attempting to split the full name")
+                logger.warning("%s: No stored names for user %s and TDSB Connects does not contain first/last name. Attempting to split the full name", log_prefix, user.pk)
                 try:
                     # Fallback: Get first and last name by splitting the full name
                     i = info.name.index(", ")
                     first_name = info.name[:i]
                     last_name = info.name[i + 2:]
                 except ValueError:
-                    logger.warning(f"{log_prefix}: Failed to split the full name for user {user.pk}, setting both first and last name to {info.name}")
+                    logger.warning("%s: Failed to split the full name for user %s, setting both first and last name to %s", log_prefix, user.pk, info.name)
                     # Fallback fallback: Set first and last name to just the full name if there's no comma
                     first_name = last_name = info.name
         return {
@@ -255,7 +255,7 @@ async def _get_fieldexpr_context(db: "db_.LockboxDB", user, course, info: typing
     else:
         # Worst case: Use the email to figure this out
         if not user.first_name or not user.last_name:
-            logger.warning(f"{log_prefix}: Name not stored for user {user.pk}, using email to find out")
+            logger.warning("%s: Name not stored for user %s, using email to find out", log_prefix, user.pk)
             try:
                 addr = user.email.split("@")[0]
                 first_name, last_name = addr.split(".")
@@ -266,7 +266,7 @@ async def _get_fieldexpr_context(db: "db_.LockboxDB", user, course, info: typing
                         break
             # Worst worst case, just default to empty :/
             except IndexError:
-                logger.warning(f"{log_prefix}: Cannot figure out name for user {user.pk}")
+                logger.warning("%s: Cannot figure out name for user %s", log_prefix, user.pk)
                 first_name = ""
                 last_name = ""
                 await warn_cb(LockboxFailureType.BAD_USER_INFO, "Warning: unable to determine your name, defaulting to empty. Please set it in the override pane.")
@@ -309,18 +309,18 @@ async def _do_fill_form(db: "db_.LockboxDB", user, course, password: str, fe_con
             value = fieldexpr.interpret(field.target_value, fe_context)
         # eww
         except Exception as e: # pylint: disable=broad-except
-            logger.error(f"{log_prefix}: Field value formatting error: {e}")
+            logger.error("%s: Field value formatting error: %s", log_prefix, e)
             raise LockboxTaskFailure(LockboxFailureType.INTERNAL, f"Fill form: Field value formatting error: {e}", True) from e
         title = field.expected_label_segment or ""
         kind = FormFieldType(field.kind)
         fields.append((field.index_on_page, title, kind, value, field.critical))
-    logger.info(f"{log_prefix}: Form filling started for course {course.course_code} for user {user.pk}")
+    logger.info("%s: Form filling started for course %s for user %s", log_prefix, course.course_code, user.pk)
     try:
         result = await asyncio.get_event_loop().run_in_executor(None, lambda: ghoster.fill_form(course.form_url,
             ghoster_credentials, fields, dry_run=dry_run))
     except ghoster.GhosterPossibleFail as e:
         message, screenshot = e.args # pylint: disable=unbalanced-tuple-unpacking
-        logger.warning(f"{log_prefix}: Possible failure for user {user.pk}: {message}\n{traceback.format_exc()}")
+        logger.warning("%s: Possible failure for user %s: %s\n%s", log_prefix, user.pk, message, traceback.format_exc())
         # Upload screenshot and report error
         screenshot_id = await db.shared_gridfs().upload_from_stream("confirmation.png", screenshot)
         await warn_cb(LockboxFailureType.FORM_FILLING, f"Possible form filling failure (Not retrying): {message}")
@@ -333,7 +333,7 @@ async def _do_fill_form(db: "db_.LockboxDB", user, course, password: str, fe_con
             fail_type = "Invalid form"
         else:
             fail_type = "Unknown failure"
-        logger.error(f"{log_prefix}: {fail_type} for user {user.pk}: {e}\n{traceback.format_exc()}")
+        logger.error("%s: %s for user %s: %s\n%s", log_prefix, fail_type, user.pk, e, traceback.format_exc())
         raise LockboxTaskFailure(LockboxFailureType.FORM_FILLING, f"{fail_type}: {e}", True) from e
 
     # Upload form and confirmation screenshots and check for potential warnings
@@ -344,7 +344,8 @@ async def _do_fill_form(db: "db_.LockboxDB", user, course, password: str, fe_con
     fid = await db.shared_gridfs().upload_from_stream("form.png", fss)
     fill_result = ResultImpl(result=FillFormResultType.SUCCESS.value if FILL_FORM_SUBMIT_ENABLED else FillFormResultType.SUBMIT_DISABLED.value,
         course=course.pk, time_logged=datetime.datetime.utcnow(), form_screenshot_id=fid)
-    fill_result.confirmation_screenshot_id = await db.shared_gridfs().upload_from_stream("confirmation.png", css) if not test else fid
+    # ghoster gives back the same object if both screenshots are identical, so only upload it once
+    fill_result.confirmation_screenshot_id = await db.shared_gridfs().upload_from_stream("confirmation.png", css) if not test and css is not fss else fid
     return fill_result
 
 
@@ -352,7 +353,7 @@ async def fill_form(db: "db_.LockboxDB", owner, retries: int, argument: str) ->
     """
     Fills in the form for a particular user.
     """
-    logger.info(f"Fill form: Starting for user {owner.pk} (login: {owner.login})")
+    logger.info("Fill form: Starting for user %s (login: %s)", owner.pk, owner.login)
     # No need to bother with recording errors for these two cases
     # Assumption: Form filling tasks exist if and only if a user has complete credentials and enabled form filling
     if not owner.active:
@@ -387,12 +388,14 @@ async def fill_form(db: "db_.LockboxDB", owner, retries: int, argument: str) ->
                 try:
                     await db.shared_gridfs().delete(owner.last_fill_form_result.form_screenshot_id)
                 except gridfs.NoFile:
-                    logger.warning(f"Fill form: Failed to delete previous result form screenshot for user {owner.pk}: No file")
-            if owner.last_fill_form_result.confirmation_screenshot_id is not None:
+                    logger.warning("Fill form: Failed to delete previous result form screenshot for user %s: No file", owner.pk)
+            # Both screenshots could be the same file
+            if owner.last_fill_form_result.confirmation_screenshot_id is not None \
+                    and owner.last_fill_form_result.confirmation_screenshot_id != owner.last_fill_form_result.form_screenshot_id:
                 try:
                     await db.shared_gridfs().delete(owner.last_fill_form_result.confirmation_screenshot_id)
                 except gridfs.NoFile:
-                    logger.warning(f"Fill form: Failed to delete previous result conformation page screenshot for user {owner.pk}: No file")
+                    logger.warning("Fill form: Failed to delete previous result conformation page screenshot for user %s: No file", owner.pk)
         owner.last_fill_form_result = result
 
     async def handle_error(kind: LockboxFailureType, message: str, retry: bool = False, course=None) -> datetime.datetime:
@@ -428,7 +431,7 @@ async def fill_form(db: "db_.LockboxDB", owner, retries: int, argument: str) ->
             password = db.fernet.decrypt(owner.password).decode("utf-8")
         except InvalidToken:
             # PANIC!
-            logger.critical(f"Fill form: User {owner.pk}'s password cannot be decrypted")
+            logger.critical("Fill form: User %s's password cannot be decrypted", owner.pk)
             return await handle_error(LockboxFailureType.INTERNAL, "Internal error: Failed to decrypt password")
 
         # Try and get data from TDSB Connects
@@ -438,30 +441,30 @@ async def fill_form(db: "db_.LockboxDB", owner, retries: int, argument: str) ->
             # If no school today just return and come back tomorrow
             # This shouldn't happen
             if not timetable:
-                logger.warning(f"Fill form: No school or async courses for user {owner.pk}")
+                logger.warning("Fill form: No school or async courses for user %s", owner.pk)
                 return next_run_time(FILL_FORM_RUN_TIME)
             # We are assuming only one async course per day
             tdsb_course = timetable[0]
             if len(timetable) > 1:
                 missed_courses = ", ".join(f"{course.course_code} in period {course.course_period}" for course in timetable[1:])
-                logger.warning(f"User {owner.pk} seems to have multiple async courses today. Missed courses: {missed_courses}")
+                logger.warning("User %s seems to have multiple async courses today. Missed courses: %s", owner.pk, missed_courses)
                 await report_failure(LockboxFailureType.BAD_USER_INFO, f"Warning: Multiple async courses detected for today, but only one form will be filled. Missed courses: {missed_courses}")
             # Re-populate courses just in case
             await db.populate_user_courses(owner, timetable, clear_previous=False)
             # Try to get the course from the database
             db_course = await db.CourseImpl.find_one({"course_code": tdsb_course.course_code})
             if db_course is None:
-                logger.error(f"Fill form: User {owner.pk} populate courses failed for {tdsb_course.course_code}")
+                logger.error("Fill form: User %s populate courses failed for %s", owner.pk, tdsb_course.course_code)
                 return await handle_error(LockboxFailureType.INTERNAL, f"Internal error: Failed to find course for {tdsb_course.course_code}", True)
         # If that fails...
         except LockboxTaskFailure as e:
             if e.failure_type != LockboxFailureType.TDSB_CONNECTS:
-                logger.error(f"Fill form: User {owner.pk} error {e.failure_type}: {e.message}")
+                logger.error("Fill form: User %s error %s: %s", owner.pk, e.failure_type, e.message)
                 return await handle_error(e.failure_type, e.message, e.retry)
             else:
                 info, tdsb_course = None, None
                 # If TDSB Connects failed, use data stored in the db instead
-                logger.warning(f"Fill form: TDSB Connects failed for user {owner.pk}: {e}")
+                logger.warning("Fill form: TDSB Connects failed for user %s: %s", owner.pk, e)
                 await report_failure(LockboxFailureType.TDSB_CONNECTS, f"Warning: TDSB Connects failed with error '{e}'. Falling back to stored data.")
                 if db.current_day is None:
                     logger.error("Fill form: Cannot fall back to stored data, don't know what day it is")
@@ -471,15 +474,17 @@ async def fill_form(db: "db_.LockboxDB", owner, retries: int, argument: str) ->
                     logger.warning("Fill form: Stored data indicates no school today. This shouldn't happen.")
                     return next_run_time(FILL_FORM_RUN_TIME)
                 if not owner.courses:
-                    logger.info(f"Fill form: No courses configured for user {owner.pk}")
+                    logger.info("Fill form: No courses configured for user %s", owner.pk)
                     return next_run_time(FILL_FORM_RUN_TIME)
                 # Find the course that runs today
                 db_course = None
+                # Fetch all the user's courses in one query, but still go through them in the user's order
+                courses = {course.pk: course async for course in db.CourseImpl.find({"_id": {"$in": owner.courses}})}
                 for course_id in owner.courses:
                     # Iterate through all courses the user has
-                    course = await db.CourseImpl.find_one({"_id": course_id})
+                    course = courses.get(course_id)
                     if course is None:
-                        logger.error(f"Fill form: Broken course reference detected: Course {course_id} for user {owner.pk}.")
+                        logger.error("Fill form: Broken course reference detected: Course %s for user %s.", course_id, owner.pk)
                         continue
                     # Check if the course runs this period
                     # This always assumes first period in the morning, should be fine
@@ -487,41 +492,41 @@ async def fill_form(db: "db_.LockboxDB", owner, retries: int, argument: str) ->
                         db_course = course
                         break
                 else:
-                    logger.info(f"Fill form: No school or async courses for user {owner.pk}")
+                    logger.info("Fill form: No school or async courses for user %s", owner.pk)
                     return next_run_time(FILL_FORM_RUN_TIME)
 
         try:
             # Get fieldexpr context
             fe_context = await _get_fieldexpr_context(db, owner, db_course, info, tdsb_course, report_failure, "Fill form")
         except LockboxTaskFailure as e:
-            logger.error(f"Fill form: User {owner.pk} error {e.failure_type}: {e.message}")
+            logger.error("Fill form: User %s error %s: %s", owner.pk, e.failure_type, e.message)
             return await handle_error(e.failure_type, e.message, e.retry, course=db_course)
 
         # All the code above sets db_course, the Course document to fill the form for, and fieldexpr_context
         # Check that the form exists & is set up
         if not db_course.has_attendance_form:
-            logger.info(f"Fill form: No form for course {db_course.course_code}")
+            logger.info("Fill form: No form for course %s", db_course.course_code)
             return next_run_time(FILL_FORM_RUN_TIME)
         if db_course.form_url is None or db_course.form_config is None:
-            logger.warning(f"Fill form: Course missing form config: {db_course.course_code}")
+            logger.warning("Fill form: Course missing form config: %s", db_course.course_code)
             return await handle_error(LockboxFailureType.CONFIG, f"Course missing form config: {db_course.course_code}")
 
         # Start filling the form
         try:
             result = await _do_fill_form(db, owner, db_course, password, fe_context, not FILL_FORM_SUBMIT_ENABLED, False, report_failure, "Fill form")
         except LockboxTaskFailure as e:
-            logger.error(f"Fill form: Filling failed for user {owner.pk} error {e.failure_type}: {e.message}")
+            logger.error("Fill form: Filling failed for user %s error %s: %s", owner.pk, e.failure_type, e.message)
             return await handle_error(e.failure_type, e.message, e.retry)
         # Set the result and finish
         await set_last_result(result)
         await owner.commit()
-        logger.info(f"Fill form: Finished for user {owner.pk}")
+        logger.info("Fill form: Finished for user %s", owner.pk)
         return next_run_time(FILL_FORM_RUN_TIME)
     except scheduler.TaskError:
         raise
     # Catch-all to make sure this never fails
     except Exception as e: # pylint: disable=broad-except
-        logger.critical(f"Fill form: Unexpected exception: {type(e).__name__}: {e}\n{traceback.format_exc()}")
+        logger.critical("Fill form: Unexpected exception: %s: %s\n%s", type(e).__name__, e, traceback.format_exc())
         message = f"Critical internal error: {type(e).__name__}: '{e}'; Please contact an admin"
         db_course = locals().get("db_course")
         return await handle_error(LockboxFailureType.INTERNAL, message, True, course=db_course.pk if db_course is not None else None)
@@ -535,7 +540,7 @@ async def populate_courses(db: "db_.LockboxDB", owner, retries: int, argument: s
     try:
         password = db.fernet.decrypt(owner.password).decode("utf-8")
     except InvalidToken as e:
-        logger.critical(f"User {owner.pk}'s password cannot be decrypted")
+        logger.critical("User %s's password cannot be decrypted", owner.pk)
         raise scheduler.TaskError("Cannot decrypt user password") from e
     # Force owner courses into pending
     # NOTE: This action used to be required *before* the task is run, so that in the event of a failure,
@@ -601,7 +606,7 @@ async def _test_fill_form_inner(db: "db_.LockboxDB", owner, context) -> bool:
         password = db.fernet.decrypt(owner.password).decode("utf-8")
     except InvalidToken:
         # PANIC!
-        logger.critical(f"Test fill form: User {owner.pk}'s password cannot be decrypted")
+        logger.critical("Test fill form: User %s's password cannot be decrypted", owner.pk)
         await set_last_result_error()
         await report_failure(LockboxFailureType.INTERNAL, "Internal error: Failed to decrypt password")
         return False
@@ -617,17 +622,17 @@ async def _test_fill_form_inner(db: "db_.LockboxDB", owner, context) -> bool:
             info = None
             await report_failure(LockboxFailureType.TDSB_CONNECTS, f"Warning: TDSB Connects failed with error '{e}'. Falling back to stored data.")
         else:
-            logger.error(f"Test fill form: Cannot get user info for user {owner.pk}: {e.failure_type}: {e.message}")
+            logger.error("Test fill form: Cannot get user info for user %s: %s: %s", owner.pk, e.failure_type, e.message)
             await set_last_result_error()
             await report_failure(e.failure_type, e.message)
             return False
 
     # Check that the form exists & is set up
     if not db_course.has_attendance_form:
-        logger.info(f"Test fill form: No form for course {db_course.course_code}")
+        logger.info("Test fill form: No form for course %s", db_course.course_code)
         return False
     if db_course.form_url is None or db_course.form_config is None:
-        logger.warning(f"Test fill form: Course missing form config: {db_course.course_code}")
+        logger.warning("Test fill form: Course missing form config: %s", db_course.course_code)
         await set_last_result_error(course=db_course.pk)
         await report_failure(LockboxFailureType.CONFIG, f"Course missing form config: {db_course.course_code}. Will not retry.")
         return False
@@ -642,7 +647,7 @@ async def _test_fill_form_inner(db: "db_.LockboxDB", owner, context) -> bool:
             e.message + (" Would've retried later." if e.retry else " Will not retry."))
         return False
     await context.commit()
-    logger.info(f"Test fill form: Finished for user {owner.pk}")
+    logger.info("Test fill form: Finished for user %s", owner.pk)
 
     return True
 
@@ -658,7 +663,7 @@ async def test_fill_form(db: "db_.LockboxDB", owner, retries: int, argument: str
     await context.commit()
 
     if context is None:
-        logger.error(f"Test fill form: unable to find context for {argument}")
+        logger.error("Test fill form: unable to find context for %s", argument)
 
         # allow this to retry for race conditions
         if retries > 2:
@@ -689,7 +694,7 @@ async def remove_old_test_result(db: "db_.LockboxDB", owner, retries: int, argum
     context = await db.find_form_test_context(argument)
 
     if context is None:
-        logger.warning(f"Test fill form cleanup: unable to find context for {argument}")
+        logger.warning("Test fill form cleanup: unable to find context for %s", argument)
 
         return
 
@@ -698,10 +703,10 @@ async def remove_old_test_result(db: "db_.LockboxDB", owner, retries: int, argum
         try:
             await db.shared_gridfs().delete(context.fill_result.form_screenshot_id)
         except gridfs.NoFile:
-            logger.warning(f"Test fill form cleanup: Failed to delete previous result form screenshot for user {context.pk}: No file")
+            logger.warning("Test fill form cleanup: Failed to delete previous result form screenshot for user %s: No file", context.pk)
 
     await context.remove()
-    logger.info(f"Test fill form cleanup: removed {argument}")
+    logger.info("Test fill form cleanup: removed %s", argument)
 
 
 async def get_form_geometry(db: "db_.LockboxDB", owner, retries: int, argument: str): # pylint: disable=unused-argument
@@ -710,11 +715,11 @@ async def get_form_geometry(db: "db_.LockboxDB", owner, retries: int, argument:
     """
     geom = await db.CachedFormGeometryImpl.find_one({"_id": bson.ObjectId(argument)})
     if not geom:
-        logger.error(f"Get form geometry: Request by user {owner.pk} cannot find document")
+        logger.error("Get form geometry: Request by user %s cannot find document", owner.pk)
         return None
     # Verify username and password
     if owner.login is None or owner.password is None:
-        logger.error(f"Get form geometry: Missing credentials for url {geom.url}")
+        logger.error("Get form geometry: Missing credentials for url %s", geom.url)
         geom.error = "Cannot sign into form: Missing credentials"
         geom.response_status = 400
         await geom.commit()
@@ -723,7 +728,7 @@ async def get_form_geometry(db: "db_.LockboxDB", owner, retries: int, argument:
     try:
         password = db.fernet.decrypt(owner.password).decode("utf-8")
     except InvalidToken:
-        logger.critical(f"User {owner.pk}'s password cannot be decrypted")
+        logger.critical("User %s's password cannot be decrypted", owner.pk)
         geom.error = "Internal server error: Cannot decrypt password"
         geom.response_status = 500
         await geom.commit()
@@ -734,7 +739,7 @@ async def get_form_geometry(db: "db_.LockboxDB", owner, retries: int, argument:
         geom.geometry = [{"index": entry[0], "title": entry[1], "kind": str(entry[2].value)} for entry in form_geom]
         return screenshot_data
 
-    logger.info(f"Get form geometry: Getting form geometry for {geom.url}")
+    logger.info("Get form geometry: Getting form geometry for %s", geom.url)
     try:
         screenshot_data = await asyncio.get_event_loop().run_in_executor(None, _inner)
         if geom.grab_screenshot:
@@ -744,7 +749,7 @@ async def get_form_geometry(db: "db_.LockboxDB", owner, retries: int, argument:
                 geom.response_status = 500
             else:
                 geom.screenshot_file_id = await db._shared_gridfs.upload_from_stream("form-thumb.png", screenshot_data)
-                logger.info(f"Get form geometry: Success for url {geom.url}")
+                logger.info("Get form geometry: Success for url %s", geom.url)
         await geom.commit()
         return None
     except ghoster.GhosterAuthFailed as e:
@@ -753,7 +758,7 @@ async def get_form_geometry(db: "db_.LockboxDB", owner, retries: int, argument:
     except ghoster.GhosterInvalidForm as e:
         geom.error = str(e)
         geom.response_status = 400
-    logger.error(f"Get form geometry: Failed with error {geom.error}")
+    logger.error("Get form geometry: Failed with error %s", geom.error)
     await geom.commit()
 
 
@@ -763,14 +768,14 @@ async def remove_old_form_geometry(db: "db_.LockboxDB", owner, retries: int, arg
     """
     geom = await db.CachedFormGeometryImpl.find_one({"_id": bson.ObjectId(argument)})
     if not geom:
-        logger.error(f"Clean form geometry: Cannot find document {argument}")
+        logger.error("Clean form geometry: Cannot find document %s", argument)
         return None
     url = geom.url
     try:
         await geom.remove()
-        logger.info(f"Form geometry deleted for url {url}")
+        logger.info("Form geometry deleted for url %s", url)
     except DeleteError as e:
-        logger.error(f"Clean form geometry: Delete error for url {url}: {e}")
+        logger.error("Clean form geometry: Delete error for url %s: %s", url, e)
 
 
 def set_task_handlers(sched: "scheduler.Scheduler"):